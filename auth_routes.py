@@ -1,10 +1,10 @@
 from flask import Blueprint, request, jsonify, make_response
 from auth_services_routes import (
-    handle_cors_preflight
+    handle_cors_preflight,
+    short_circuit_cors_preflight
 )
 import logging 
 import os
-import traceback
 from datetime import datetime
 
 # Initialize the blueprint
@@ -12,13 +12,11 @@ auth_routes = Blueprint('auth_routes', __name__)
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+auth_routes.before_request(short_circuit_cors_preflight)
+
 # Add a route for debugging to help diagnose issues
 @auth_routes.route("/test-mfa-code", methods=["POST", "OPTIONS"])
 def test_mfa_code():
-    if request.method == "OPTIONS":
-        return handle_cors_preflight()
-    
-    data = request.json
     # Simulate TOTP code validation or just echo back
     return jsonify({
         "server_time": datetime.utcnow().isoformat() + "Z",
@@ -54,9 +52,6 @@ def debug_info():
 
 @auth_routes.route("/test", methods=["GET", "OPTIONS"])
 def test_route():
-    if request.method == "OPTIONS":
-        return handle_cors_preflight()
-        
     logger.info("Test route accessed successfully.")
     return jsonify({"message": "GET /test route works!"}), 200
 
@@ -95,8 +90,7 @@ def login_disabled():
             logger.warning(f"Authentication returned error: {auth_response[0]}")
             return jsonify(auth_response[0]), auth_response[1]
     except Exception as e:
-        logger.error(f"Error during authentication: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error during authentication: %s", e)
         return jsonify({"detail": f"Authentication failed: {str(e)}"}), 401
 
     # MFA Handling
@@ -152,8 +146,7 @@ def confirm_signup_endpoint_disabled():
             logger.warning(f"Failed to confirm sign-up for {email}")
             return jsonify({"detail": "Failed to confirm sign-up"}), 400
     except Exception as e:
-        logger.error(f"Signup confirmation failed: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Signup confirmation failed: %s", e)
         return jsonify({"detail": f"Signup confirmation failed: {e}"}), 400
 
     logger.info(f"Password change successful for {email}")
@@ -208,8 +201,7 @@ def verify_mfa_endpoint_disabled():
         })
         
     except Exception as e:
-        logger.error(f"MFA verification failed: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("MFA verification failed: %s", e)
         return jsonify({"detail": f"MFA verification failed: {e}"}), 401
 
     # CORS Headers
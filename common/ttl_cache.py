@@ -0,0 +1,42 @@
+"""
+TTL Cache - Small thread-safe expiring cache shared by the auth service caches
+"""
+import threading
+import time
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """
+    Thread-safe mapping whose entries expire ttl seconds after they are set.
+    When full, the oldest entry is evicted (dicts keep insertion order).
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return default
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store value for ttl seconds, replacing any existing entry."""
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            if len(self._entries) >= self.maxsize:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (value, expires_at)
+
+    def replace(self, key: Hashable, value: Any) -> None:
+        """Swap the value of an existing entry without extending its expiry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (value, entry[1])
@@ -1,16 +1,36 @@
+import atexit
+import hashlib
 import logging
+import logging.handlers
 import os
+import queue
+import ssl
 import sys
-import traceback
+import orjson
 from flask import Flask, request, jsonify, make_response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone
 
 load_dotenv()
 
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson. Types orjson does not handle natively (Decimal,
+    datetime as HTTP dates, etc.) fall back to Flask's default serializer.
+    """
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Initialize the Flask app
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # COMPREHENSIVE CORS CONFIGURATION
 cors_origins = os.getenv("CORS_ORIGINS", "https://console-encryptgate.net")
@@ -58,11 +78,29 @@ if os.getenv("FLASK_ENV") != "development":
         # If we can't write to the log file (e.g., local dev), just use console
         logger.warning(f"Could not set up file logging: {e}. Using console only.")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
-    handlers=log_handlers
-)
+# Request threads only merge the message (and any traceback) and enqueue the record;
+# a single listener thread applies the line format and does the stdout/file writes,
+# so disk I/O stays off the request path
+log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s - %(message)s")
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+
+log_queue = queue.SimpleQueue()
+queue_handler = logging.handlers.QueueHandler(log_queue)
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# Attached directly rather than through basicConfig, which would give the queue handler
+# its default "LEVEL:name:" format and prefix every line twice
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(queue_handler)
+
+# Secret hashes and TOTP codes rely on hashlib/hmac; confirm they run on OpenSSL's
+# EVP implementations (which use SHA-NI/ARMv8 crypto extensions) rather than the builtin fallback
+sha256_backend = "OpenSSL" if hashlib.sha256.__name__.startswith("openssl_") else "builtin"
+logger.info("Crypto backend: %s, hashlib sha256 via %s", ssl.OPENSSL_VERSION, sha256_backend)
 
 # Import and register blueprints
 try:
@@ -74,8 +112,7 @@ try:
     
     logger.info("Successfully registered blueprints")
 except Exception as e:
-    logger.error(f"Failed to register blueprints: {e}")
-    logger.error(traceback.format_exc())
+    logger.exception("Failed to register blueprints: %s", e)
 
 # Health check endpoints
 @app.route("/", methods=["GET"])